@@ -1,12 +1,18 @@
 import configparser
+import errno
 import json
 import os
+import re
 import shutil
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
 from zhipuai import ZhipuAI
 
 # 配置文件路径
 config_file = 'config.conf'
+# 分类结果缓存文件路径
+cache_file = 'classify_cache.json'
 
 # 检查 .conf 文件是否存在
 if not os.path.exists(config_file):
@@ -19,7 +25,18 @@ if not os.path.exists(config_file):
         'output_directory': '',  # 新增分类输出目录字段，用户手动填写
         'description': '根据文件名称推测其属于的学科(如语文、英语、数学、物理、化学、生物），不确定返回未知',
         'subjects': '语文,英语,数学,物理,化学,生物,未知',  # 默认值，用户可根据需要修改
-        'allowed_extensions': ''  #扩展名白名单，多个扩展名用逗号分隔，如 "pdf,docx,txt"
+        'allowed_extensions': '',  #扩展名白名单，多个扩展名用逗号分隔，如 "pdf,docx,txt"
+        'batch_size': '10',  # 每次请求中一起分类的文件数量
+        'max_workers': ''  # 同时进行的API请求数量，留空则根据CPU核数自动设置
+    }
+
+    # 学科关键词，文件名中包含关键词时直接分类，不调用API；多个关键词用逗号分隔
+    config['keywords'] = {
+        '英语': 'english',
+        '数学': 'math',
+        '物理': 'physics',
+        '化学': 'chemistry',
+        '生物': 'biology'
     }
 
     # 写入到文件中，确保以 UTF-8 编码保存
@@ -34,27 +51,56 @@ if not os.path.exists(config_file):
 config = configparser.ConfigParser()
 config.read(config_file, encoding='utf-8')
 
+# 检查必填的配置项，缺少或为空的项一次全部列出
+required_options = ('api_key', 'path', 'output_directory')
+filled_options = set()
+if config.has_section('settings'):
+    filled_options = {option for option, value in config.items('settings') if value.strip()}
+missing_options = set(required_options) - filled_options
+if missing_options:
+    print(f"{config_file} 文件中的 {'、'.join(sorted(missing_options, key=required_options.index))} 信息为空，请补全配置后再运行此程序。")
+    exit()
+
 # 从 .conf 文件中获取 api_key 和路径
 api_key = config.get('settings', 'api_key')
 path = config.get('settings', 'path')
 output_directory = config.get('settings', 'output_directory')  # 新增输出目录
 description = config.get('settings', 'description')
-subjects = config.get('settings', 'subjects').split(',')
+subjects = [subject.strip() for subject in config.get('settings', 'subjects').split(',') if subject.strip()]
 allowed_extensions = config.get('settings', 'allowed_extensions')
+batch_size = config.get('settings', 'batch_size', fallback='10')  # 旧配置文件中没有该项时使用默认值
+max_workers = config.get('settings', 'max_workers', fallback='')
 
-# 如果 allowed_extensions 不为空，则转换为列表
+# 如果 allowed_extensions 不为空，则转换为集合，过滤文件时直接判断是否包含
 if allowed_extensions:
-    allowed_extensions = [ext.strip().lower() for ext in allowed_extensions.split(',')]
+    allowed_extensions = frozenset(ext.strip().lower() for ext in allowed_extensions.split(',') if ext.strip())
 else:
     allowed_extensions = None  # 如果为空，则允许所有文件
 
-# 检查配置文件内容是否为空
-if not api_key or not path or not output_directory:
-    print(f"{config_file} 文件中的 api_key、path 或 output_directory 信息为空，请补全配置后再运行此程序。")
+# batch_size 和 max_workers 必须是整数；并发请求数量为空时按CPU核数估算
+try:
+    batch_size = max(1, int(batch_size))
+    max_workers = int(max_workers) if max_workers else (os.cpu_count() or 1) * 2
+except ValueError as e:
+    print(f"{config_file} 文件中的 batch_size 或 max_workers 不是整数，请检查 {config_file} 中的配置: {e}")
     exit()
+# 并发请求数量限制在 1 到 32 之间，避免请求过多触发接口限流
+max_workers = min(32, max(1, max_workers))
+
+# 模型无法分类或返回的学科不在列表中时归入未知
+if "未知" not in subjects:
+    subjects.append("未知")
+subject_set = frozenset(subjects)
+# 用于从模型的文字回答中查找学科名称，较长的名称优先匹配
+subject_pattern = re.compile('|'.join(re.escape(subject) for subject in sorted(subjects, key=len, reverse=True)))
 
-# 设置API Key
-client = ZhipuAI(api_key=api_key)
+# 设置API Key，连接超时单独设置得较短，接口无法连接时尽快失败重试
+# 连接池保持的连接数与并发请求数量一致，每个线程都能复用已建立的连接
+client = ZhipuAI(
+    api_key=api_key,
+    timeout=httpx.Timeout(60.0, connect=3.05),
+    http_client=httpx.Client(limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers))
+)
 
 # 定义工具函数，用于调用API
 tools = [
@@ -66,62 +112,209 @@ tools = [
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "filename": {
-                        "type": "string",
-                        "description": "文件名称",
-                    },
-                    "subject": {
-                        "type": "string",
-                        "description": "学科",
+                    "files": {
+                        "type": "array",
+                        "description": "每个文件的分类结果",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "index": {
+                                    "type": "integer",
+                                    "description": "文件序号",
+                                },
+                                "filename": {
+                                    "type": "string",
+                                    "description": "文件名称",
+                                },
+                                "subject": {
+                                    "type": "string",
+                                    "description": "学科",
+                                },
+                            },
+                            "required": ["index", "filename", "subject"],
+                        },
                     },
                 },
-                "required": ["filename", "subject"],
+                "required": ["files"],
             },
         }
     }
 ]
 
-# 创建目标分类文件夹
-for subject in subjects:
-    folder_path = os.path.join(output_directory, subject.strip())
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
+# 读取分类结果缓存，描述或学科列表变化后缓存失效
+cache_settings = {'version': 2, 'description': description, 'subjects': subjects}
+classification_cache = {}
+if os.path.exists(cache_file):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as cachefile:
+            cache_data = json.load(cachefile)
+        # 缓存文件被手动修改成其他结构时不使用，学科不在配置中的条目也忽略，避免移动时出错
+        if isinstance(cache_data, dict) and cache_data.get('settings') == cache_settings \
+                and isinstance(cache_data.get('results'), dict):
+            classification_cache = {cache_key: subject for cache_key, subject in cache_data['results'].items()
+                                    if isinstance(cache_key, str) and isinstance(subject, str) and subject in subject_set}
+    except (OSError, ValueError) as e:
+        print(f"读取缓存文件 {cache_file} 失败，将重新分类: {e}")
 
-# 获取指定路径下的文件列表
-files = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
+# 可以直接从文件名匹配的学科名称本身，以及 [keywords] 中配置的关键词（可选）
+# configparser 会把键转换为小写，这里按小写对应回配置中的学科名称
+subject_keywords = {subject.lower(): subject for subject in subjects if subject != "未知"}
+if config.has_section('keywords'):
+    subjects_by_lower_name = {subject.lower(): subject for subject in subjects}
+    for subject_name, keywords in config.items('keywords'):
+        subject = subjects_by_lower_name.get(subject_name.strip())
+        if subject and subject != "未知":
+            for keyword in keywords.split(','):
+                if keyword.strip():
+                    subject_keywords[keyword.strip().lower()] = subject
+# 所有关键词编译为一个正则，一次扫描文件名即可找出全部匹配，较长的关键词优先匹配
+# 英文关键词前后不能紧接字母，避免 paper 中的 pe、start 中的 art 被误匹配；中文关键词直接按子串匹配
+keyword_pattern = re.compile('|'.join(
+    rf'(?<![a-z]){re.escape(keyword)}(?![a-z])' if keyword.isascii() else re.escape(keyword)
+    for keyword in sorted(subject_keywords, key=len, reverse=True)
+), re.IGNORECASE)
 
-# 如果 allowed_extensions 不为空，则过滤符合扩展名的文件
-if allowed_extensions:
-    files = [f for f in files if os.path.splitext(f)[1][1:].lower() in allowed_extensions]
+# 创建目标分类文件夹，并记录每个学科对应的路径，移动文件时直接使用
+subject_directories = {subject: os.path.join(output_directory, subject) for subject in subjects}
+for folder_path in subject_directories.values():
+    os.makedirs(folder_path, exist_ok=True)
+
+# 获取指定路径下的文件列表，os.scandir 遍历时已带有文件类型，无需再逐个检查
+# 如果 allowed_extensions 不为空，则同时过滤符合扩展名的文件
+# 目录不存在或无法访问时由 os.scandir 直接报错，不需要事先单独检查
+try:
+    with os.scandir(path) as entries:
+        files = [entry.name for entry in entries
+                 if entry.is_file()
+                 and (not allowed_extensions or os.path.splitext(entry.name)[1][1:].lower() in allowed_extensions)]
+except (FileNotFoundError, NotADirectoryError, PermissionError) as e:
+    print(f"无法读取 path 目录 {path}，请检查 {config_file} 中的配置: {e}")
+    exit()
 
 # 如果没有符合条件的文件，给出提示
 if not files:
-    print(f"没有符合扩展名 {allowed_extensions} 的文件。")
+    print(f"没有符合扩展名 {sorted(allowed_extensions) if allowed_extensions else None} 的文件。")
     exit()
 
+# 记录每个目标文件夹中每个文件名下一次尝试的数字后缀，按 (文件夹, 文件名主干, 扩展名) 保存
+# 首次遇到重名时扫描一次该文件夹，根据之前运行留下的 name_1、name_2 等文件确定起始数字，
+# 同名文件较多时无需每次从 1 开始逐个检查；只在主线程中移动文件时使用，不需要加锁
+name_counters = {}
+scanned_directories = set()
+
+
+# 定义函数用于扫描目标文件夹，记录已有文件名的最大数字后缀
+# 主干和扩展名按小写记录，兼容不区分大小写的文件系统
+def scan_name_counters(directory):
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            base_name, extension = os.path.splitext(entry.name)
+            prefix, _, suffix = base_name.rpartition('_')
+            if prefix and suffix.isascii() and suffix.isdigit():
+                counter_key = (directory, prefix.lower(), extension.lower())
+                name_counters[counter_key] = max(name_counters.get(counter_key, 1), int(suffix) + 1)
+    scanned_directories.add(directory)
+
+
 # 定义函数用于检测文件名是否重复，并添加数字后缀
 def get_unique_filename(directory, file_name):
-    base_name, extension = os.path.splitext(file_name)
-    counter = 1
     new_file_name = file_name
 
     # 检查目标文件夹是否已经存在该文件
-    while os.path.exists(os.path.join(directory, new_file_name)):
+    if os.path.exists(os.path.join(directory, new_file_name)):
+        if directory not in scanned_directories:
+            scan_name_counters(directory)
+        base_name, extension = os.path.splitext(file_name)
+        counter_key = (directory, base_name.lower(), extension.lower())
+        counter = name_counters.get(counter_key, 1)
         new_file_name = f"{base_name}_{counter}{extension}"
-        counter += 1
+        # 扫描之后新出现的文件仍可能占用该名称，继续检查直到不重复
+        while os.path.exists(os.path.join(directory, new_file_name)):
+            counter += 1
+            new_file_name = f"{base_name}_{counter}{extension}"
+        name_counters[counter_key] = counter + 1
 
     return new_file_name
 
 
-# 定义调用智谱AI的函数
-def classify_file(file_name):
-    # 准备要发送的消息
+# 定义函数用于判断匹配到的关键词是否是完整的单词写法（全小写、全大写或首字母大写），
+# 驼峰写法中的一部分（如 hiStory）不算匹配；中文关键词不受影响
+def is_keyword_word(keyword):
+    return not keyword.isascii() or keyword.islower() or keyword.isupper() or keyword.istitle()
+
+
+# 定义函数用于根据文件名中包含的学科名称或关键词直接分类，只匹配到一个学科时才采用
+def classify_by_keyword(file_name):
+    matched_subjects = {subject_keywords[keyword.lower()] for keyword in keyword_pattern.findall(file_name)
+                        if keyword and is_keyword_word(keyword)}
+    return matched_subjects.pop() if len(matched_subjects) == 1 else None
+
+
+# 定义函数用于生成缓存键，只取文件名主干，并忽略大小写和多余空白
+# 同一份资料常有不同格式的副本（如 作业.docx 和 作业.pdf），只需分类一次
+def get_cache_key(file_name):
+    return ' '.join(os.path.splitext(file_name)[0].split()).lower()
+
+
+# 定义函数用于找出返回结果对应的文件：单个文件时直接对应，批量时按序号对应，
+# 没有有效序号时再按缓存键比较文件名（模型返回的文件名可能省略扩展名或改变空白）
+def match_file_name(item, file_names, file_names_by_key):
+    if len(file_names) == 1:
+        return file_names[0]
+    index = str(item.get("index", "")).strip()
+    if index.isdigit() and 1 <= int(index) <= len(file_names):
+        return file_names[int(index) - 1]
+    return file_names_by_key.get(get_cache_key(str(item.get("filename", ""))))
+
+
+# 定义函数用于从工具调用的参数中提取每个文件的学科，兼容单个文件的返回格式
+# 格式不正确的工具调用或条目直接跳过，只影响对应的文件，这些文件稍后会逐个重新分类
+def parse_tool_calls(tool_calls, file_names):
+    file_names_by_key = {get_cache_key(file_name): file_name for file_name in file_names}
+    results = {}
+    for tool_call in tool_calls:
+        try:
+            arguments = json.loads(tool_call.function.arguments)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(arguments, dict):
+            continue
+        items = arguments.get("files", [arguments])
+        if not isinstance(items, list):
+            items = []
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            file_name = match_file_name(item, file_names, file_names_by_key)
+            if file_name is None:
+                continue
+            subject = str(item.get("subject", "")).strip()
+            # 只接受配置中的学科，避免移动到不存在的文件夹
+            results[file_name] = subject if subject in subject_set else "未知"
+    return results
+
+
+# 定义函数用于从模型的文字回答中查找学科名称
+# 回答中常会引用文件名，而文件名本身可能包含多个学科名称，先去掉文件名，且只在出现唯一一个学科时才采用
+def guess_subject_from_text(content, file_name):
+    for name in (file_name, os.path.splitext(file_name)[0]):
+        content = content.replace(name, '')
+    matched_subjects = set(subject_pattern.findall(content))
+    return matched_subjects.pop() if len(matched_subjects) == 1 else None
+
+
+# 定义调用智谱AI的函数，一次请求分类多个文件，返回 ({文件名: 学科}, 从文字回答推测学科的文件名集合)
+def classify_files(file_names):
+    # 准备要发送的消息，每行一个带序号的文件名，结果按序号对应回文件
+    numbered_file_names = "\n".join(f"{index}. {file_name}" for index, file_name in enumerate(file_names, 1))
     messages = [
         {
             "role": "user",
-            "content": file_name
+            "content": f"请对以下每一行的文件分别分类，不要遗漏，并在结果中附上对应的文件序号：\n{numbered_file_names}"
         }
     ]
+    results = {}
+    guessed_file_names = set()
 
     try:
         # 使用 chat.completions.create() 调用API
@@ -131,33 +324,101 @@ def classify_file(file_name):
             tools=tools,
             tool_choice="auto"
         )
-
-        # 获取返回的工具调用内容
-        if response.choices:
-            tool_calls = response.choices[0].message.tool_calls  # 直接访问属性
-            if tool_calls:
-                # 从返回的JSON中提取subject
-                result = json.loads(tool_calls[0].function.arguments)
-                subject = result.get("subject", "未知")
-                return subject
     except Exception as e:
         # 打印完整的异常信息
         print(f"API 调用失败: {e}")
         traceback.print_exc()  # 打印异常堆栈信息
-        return "未知"
+        return {file_name: "未知" for file_name in file_names}, guessed_file_names
 
+    # 获取返回的工具调用内容
+    if response.choices:
+        message = response.choices[0].message
+        tool_calls = message.tool_calls  # 直接访问属性
+        if tool_calls:
+            # 从返回的JSON中提取每个文件的subject
+            results = parse_tool_calls(tool_calls, file_names)
+        # 单个文件时模型可能不调用工具而直接用文字回答，从回答中查找学科名称
+        elif len(file_names) == 1 and message.content:
+            subject = guess_subject_from_text(message.content, file_names[0])
+            if subject:
+                results[file_names[0]] = subject
+                guessed_file_names.add(file_names[0])
 
-# 遍历指定路径下的文件，进行分类并移动
-for file_name in files:
-    subject = classify_file(file_name)  # 调用API获取学科分类
+    # 批量返回的结果中缺少的文件，逐个重新分类
+    if len(file_names) > 1:
+        for file_name in file_names:
+            if file_name not in results:
+                single_results, single_guessed_file_names = classify_files([file_name])
+                results.update(single_results)
+                guessed_file_names |= single_guessed_file_names
+
+    return {file_name: results.get(file_name, "未知") for file_name in file_names}, guessed_file_names
+
+
+# 定义函数用于移动文件，同一磁盘内直接重命名，跨磁盘时才由 shutil.move 复制后删除
+def fast_move(source_path, destination_path):
+    try:
+        os.replace(source_path, destination_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source_path, destination_path)
+
+
+# 定义函数用于将文件移动到对应学科文件夹
+def move_file(file_name, subject):
     source_path = os.path.join(path, file_name)
-    destination_directory = os.path.join(output_directory, subject)
+    destination_directory = subject_directories[subject]
 
     # 检查文件名是否重复，获取唯一的文件名
     unique_file_name = get_unique_filename(destination_directory, file_name)
     destination_path = os.path.join(destination_directory, unique_file_name)
 
     # 移动文件到对应学科文件夹
-    shutil.move(source_path, destination_path)
+    fast_move(source_path, destination_path)
     print(
         f"文件 '{file_name}' 已分类到 {subject} 文件夹，重命名为 '{unique_file_name}'." if unique_file_name != file_name else f"文件 '{file_name}' 已分类到 {subject} 文件夹。")
+
+
+# 文件名包含学科名称或已缓存的文件直接分类，其余文件按缓存键去重后分批并发调用API进行分类
+local_subjects = {}
+pending_groups = {}
+for file_name in files:
+    cache_key = get_cache_key(file_name)
+    subject = classify_by_keyword(file_name) or classification_cache.get(cache_key)
+    if subject:
+        local_subjects[file_name] = subject
+    else:
+        pending_groups.setdefault(cache_key, []).append(file_name)
+pending_files = [group[0] for group in pending_groups.values()]
+batches = [pending_files[start:start + batch_size] for start in range(0, len(pending_files), batch_size)]
+
+try:
+    for file_name, subject in local_subjects.items():
+        move_file(file_name, subject)
+
+    if batches:
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(batches)))
+        try:
+            futures = [executor.submit(classify_files, batch) for batch in batches]
+
+            # 在主线程中按完成顺序移动文件，避免并发检查重名
+            for future in as_completed(futures):
+                batch_subjects, guessed_file_names = future.result()
+
+                # 先写入缓存再移动文件，移动失败时已经调用API得到的结果也不会丢失
+                # 未知可能是API调用失败导致的，从文字回答推测的学科也不一定可靠，都不写入缓存，下次重新分类
+                for file_name, subject in batch_subjects.items():
+                    if subject != "未知" and file_name not in guessed_file_names:
+                        classification_cache[get_cache_key(file_name)] = subject
+
+                for file_name, subject in batch_subjects.items():
+                    for same_file_name in pending_groups[get_cache_key(file_name)]:
+                        move_file(same_file_name, subject)
+        finally:
+            # 移动文件出错或按下 Ctrl+C 时取消尚未开始的批次，不再继续调用API
+            executor.shutdown(wait=False, cancel_futures=True)
+finally:
+    # 保存分类结果缓存
+    with open(cache_file, 'w', encoding='utf-8') as cachefile:
+        json.dump({'settings': cache_settings, 'results': classification_cache}, cachefile, ensure_ascii=False, indent=4)